@@ -7,60 +7,150 @@ AUTHOR: Erel Segal-Halevi:
 SINCE : 2021-05
 """
 
-import pandas, numpy as np, re, numbers, logging
+import pandas, numpy as np, re, numbers, logging, functools, importlib.util
 from collections import defaultdict
 
 logger = logging.getLogger(__name__)
 
+# pyarrow is optional: its multi-threaded CSV parser is much faster than the default one on large panels.
+CSV_ENGINE = "pyarrow" if importlib.util.find_spec("pyarrow") is not None else "c"
+
+OPEN_QUESTION_CODE_PUNCTUATION = re.compile(':? ?')
+QUESTION_CODE = re.compile(r'Q\d+')        # Panel4All codes its questions "Q1", "Q2", ...
+SUBQUESTION_CODE = re.compile(r'(.+)_\d+')  # ... and the subquestions of "Q3" as "Q3_1", "Q3_2", ...
+MAX_ANSWER_CODE_IN_ARRAY = 1024
+
+def rank_matrix(answers:np.ndarray)->np.ndarray:
+	"""
+	For each row of the given matrix, returns the column indices sorted by increasing value (ties keep their order).
+
+	>>> rank_matrix(np.array([[3, 1, 2], [1, 2, 1]]))
+	array([[1, 2, 0],
+	       [0, 2, 1]])
+	"""
+	return np.argsort(answers, axis=1, kind="stable")
+
+INTEGER_DTYPES = [np.dtype(np.int8), np.dtype(np.int16), np.dtype(np.int32), np.dtype(np.int64)]
+
+def integer_column_dtypes(table:pandas.DataFrame)->dict:
+	"""
+	For each column of the given numeric table whose values are all integers (with no missing values),
+	returns the smallest integer dtype that can hold its values. All columns are checked in a single pass.
+
+	>>> integer_column_dtypes(pandas.DataFrame({"a": [1.0, 2.0], "b": [1.5, 2.0], "c": [1.0, None], "d": [0.0, 300.0]}))
+	{'a': dtype('int8'), 'd': dtype('int16')}
+	"""
+	if table.shape[0]==0 or table.shape[1]==0:
+		return {}
+	values = table.to_numpy(dtype=np.float64)
+	is_integer = np.isfinite(values).all(axis=0) & (values==np.round(values)).all(axis=0)
+	minima = values.min(axis=0)
+	maxima = values.max(axis=0)
+	column_dtypes = {}
+	for column, column_is_integer, minimum, maximum in zip(table.columns, is_integer, minima, maxima):
+		if column_is_integer:
+			column_dtypes[column] = next(dtype for dtype in INTEGER_DTYPES if np.iinfo(dtype).min <= minimum and maximum <= np.iinfo(dtype).max)
+	return column_dtypes
+
+
 class PollResults:
 	def initialize_from_filenames(self, variable_information_file:str, variable_values_file:str, results_closed_questions_file:str, results_open_questions_file:str=None):
+		if results_open_questions_file:
+			results_open_questions = pandas.read_csv(results_open_questions_file, engine=CSV_ENGINE)
+			results_open_questions.columns = results_open_questions.columns.str.replace(OPEN_QUESTION_CODE_PUNCTUATION, "", regex=True)  # "Q8_1: " -> "Q8_1"
+		else:
+			results_open_questions = None
+		variable_information_table = pandas.read_csv(variable_information_file, header=1, engine=CSV_ENGINE).iloc[:-1]   # the first row is a title and the last row is a footer
+		float_columns = variable_information_table.select_dtypes("float").columns   # the empty cells of the footer turned integer columns such as "Position" into floats
+		variable_information_table = variable_information_table.astype(dict.fromkeys(integer_column_dtypes(variable_information_table[float_columns]), np.int64))
 		return self.initialize_from_dataframes(
-			variable_information_table = pandas.read_csv(variable_information_file, skiprows=1, skipfooter=1, engine='python'),
-			variable_values_table = pandas.read_csv(variable_values_file, skiprows=1),
-			results_closed_questions = pandas.read_csv(results_closed_questions_file),
-			results_open_questions = pandas.read_csv(results_open_questions_file).rename(columns=lambda x: re.sub(':? ?','',x)) if results_open_questions_file else None,
+			variable_information_table = variable_information_table,
+			variable_values_table = pandas.read_csv(variable_values_file, header=1, engine=CSV_ENGINE),
+			results_closed_questions = pandas.read_csv(results_closed_questions_file, engine=CSV_ENGINE, dtype={"start": str, "finish": str}),   # the pyarrow engine would parse these as dates
+			results_open_questions = results_open_questions,
 		)
 
 	def initialize_from_dataframes(self, variable_information_table:pandas.DataFrame, variable_values_table:pandas.DataFrame, results_closed_questions:pandas.DataFrame, results_open_questions:pandas.DataFrame=None):
+		for cached_property in ["map_voter_id_to_closed_answers", "map_voter_id_to_open_answers"]:   # in case this object is re-initialized
+			self.__dict__.pop(cached_property, None)
+
 		### 1. Variable information table --- map question code to label.
 		self.variable_information_table = variable_information_table
 		logger.debug("variable_information_table:\n%s", self.variable_information_table)
-		self.map_question_code_to_label = {row["Variable"]: row["Label"] for index, row in self.variable_information_table.iterrows()}
+		self.map_question_code_to_label = dict(zip(self.variable_information_table["Variable"].to_numpy(), self.variable_information_table["Label"].to_numpy()))
 		logger.debug("map_question_code_to_label:\n%s",self.map_question_code_to_label)
+		self.question_codes_and_labels = tuple(self.map_question_code_to_label.items())   # for the reporting loops
+		self.map_question_code_to_subquestion_codes = defaultdict(list)
+		for code in self.map_question_code_to_label:
+			match = SUBQUESTION_CODE.fullmatch(code)
+			if match is not None:
+				base_code = match.group(1)
+				if base_code in self.map_question_code_to_label or QUESTION_CODE.fullmatch(base_code):   # skip "ext_id", "col_10" etc.
+					self.map_question_code_to_subquestion_codes[base_code].append(code)
+		self.map_question_code_to_subquestion_codes = dict(self.map_question_code_to_subquestion_codes)
+		self.map_question_code_to_subquestion_labels = {
+			question_code: np.array([self.map_question_code_to_label[code] for code in subquestion_codes], dtype=object)
+			for question_code, subquestion_codes in self.map_question_code_to_subquestion_codes.items()
+		}
 
 		### 2. Variable values table --- map answer code to label.
 		self.variable_values_table = variable_values_table
 		logger.debug("variable_values_table:\n%s", self.variable_values_table)
-		map_question_code_to_map_answer_code_to_label = defaultdict(dict)
-		for _,row in self.variable_values_table.iterrows():
-			question_code_raw = row.iloc[0]
-			if  pandas.isnull(question_code_raw):
-				pass
-			else:
-				question_code = question_code_raw
-			answer_code = row.iloc[1]
-			answer_label = row.iloc[2]
-			map_question_code_to_map_answer_code_to_label[question_code][answer_code] = answer_label
-		self.map_question_code_to_map_answer_code_to_label = dict(map_question_code_to_map_answer_code_to_label)
+		question_codes = self.variable_values_table.iloc[:,0].ffill()   # the question code appears only in the first row of each question
+		self.map_question_code_to_map_answer_code_to_label = {}
+		for question_code, answer_code, answer_label in zip(question_codes.tolist(), self.variable_values_table.iloc[:,1].tolist(), self.variable_values_table.iloc[:,2].tolist()):
+			self.map_question_code_to_map_answer_code_to_label.setdefault(question_code, {})[answer_code] = answer_label
 		logger.debug("map_question_code_to_map_answer_code_to_label:\n%s", self.map_question_code_to_map_answer_code_to_label)
+		self.map_question_code_to_answer_label_array = {}   # when the answer codes are small non-negative integers, label_array[answer_code] is the label.
+		for question_code, map_answer_code_to_label in self.map_question_code_to_map_answer_code_to_label.items():
+			answer_codes = list(map_answer_code_to_label.keys())
+			if all(isinstance(answer_code, numbers.Integral) for answer_code in answer_codes) and 0 <= min(answer_codes) and max(answer_codes) < MAX_ANSWER_CODE_IN_ARRAY:
+				label_array = np.full(max(answer_codes)+1, None, dtype=object)
+				label_array[answer_codes] = list(map_answer_code_to_label.values())
+				self.map_question_code_to_answer_label_array[question_code] = label_array
 
 		### 3. Results to closed questions
-		self.results_closed_questions = results_closed_questions
+		if not results_closed_questions["id"].is_unique:   # a voter who answered twice: keep the last answers, so that voter ids index single rows
+			logger.warning("Duplicate voter ids in results_closed_questions; keeping the last row of each voter")
+			results_closed_questions = results_closed_questions.drop_duplicates("id", keep="last")
+		coded_columns = [
+			question_code for question_code in self.map_question_code_to_map_answer_code_to_label
+			if question_code in results_closed_questions and pandas.api.types.is_numeric_dtype(results_closed_questions[question_code])
+		]
+		# Answer codes are small integers, so they are stored in int8/int16 columns instead of float64.
+		# Note that arithmetic on these columns of results_closed_questions wraps around on overflow.
+		self.results_closed_questions = results_closed_questions.astype(integer_column_dtypes(results_closed_questions[coded_columns]))
+		self.results_closed_questions.index = pandas.Index(self.results_closed_questions["id"].to_numpy(dtype=np.int64), name="voter_id")
 		logger.debug("results_closed_questions:\n%s", self.results_closed_questions)
 		self.columns = self.results_closed_questions.columns
-		self.map_voter_id_to_closed_answers = {int(row["id"]): row for _, row in self.results_closed_questions.iterrows()}
-		logger.debug("map_voter_id_to_closed_answers:\n%s", self.map_voter_id_to_closed_answers)
-		self.voter_ids = list(self.map_voter_id_to_closed_answers.keys())
+		self.voter_ids = self.results_closed_questions.index.to_numpy()
+		self.map_column_to_index = {column: column_index for column_index, column in enumerate(self.columns)}
+		self.map_column_to_answers = {column: self.results_closed_questions[column].to_numpy() for column in self.columns}   # views of the numeric columns (only the few text columns are copied), so a voter's answer is a single array lookup
+		self.frequency_dicts_cache = {}   # results_closed_questions is not modified after initialization, so frequency tables can be reused.
 
 		### 4. Results to open questions
 		if results_open_questions is not None:
-			self.results_open_questions = results_open_questions
-			self.map_voter_id_to_open_answers = {int(row["user_ID"]): row for _, row in self.results_open_questions.iterrows()}
-			logger.debug("map_voter_id_to_open_answers:\n%s",self.map_voter_id_to_open_answers)
+			if not results_open_questions["user_ID"].is_unique:
+				logger.warning("Duplicate voter ids in results_open_questions; keeping the last row of each voter")
+				results_open_questions = results_open_questions.drop_duplicates("user_ID", keep="last")
+			self.results_open_questions = results_open_questions.set_axis(pandas.Index(results_open_questions["user_ID"].to_numpy(dtype=np.int64), name="voter_id"))
 		else:
-			self.results_open_questions =  self.map_voter_id_to_open_answers = None
+			self.results_open_questions = None
 			logger.debug("No open questions file")
 
+		### 5. The kind of each question, and the column that contains its answers
+		open_columns = set(self.results_open_questions.columns) if self.results_open_questions is not None else set()
+		closed_columns = set(self.columns)
+		self.map_question_code_to_kind_and_column = {}
+		for question_code in self.map_question_code_to_label:
+			if question_code in open_columns:               # open (free-text) question
+				self.map_question_code_to_kind_and_column[question_code] = ("open", question_code)
+			elif f"{question_code}_1" in open_columns:      # open (free-text) question
+				self.map_question_code_to_kind_and_column[question_code] = ("open", f"{question_code}_1")
+			elif question_code in closed_columns:           # closed question
+				kind = "coded" if question_code in self.map_question_code_to_map_answer_code_to_label else "data"
+				self.map_question_code_to_kind_and_column[question_code] = (kind, question_code)
+
 		return self
 
 
@@ -74,18 +164,20 @@ class PollResults:
 			variable_information_table = self.variable_information_table,
 			variable_values_table = self.variable_values_table,
 			results_closed_questions = self.results_closed_questions.query(filter_query),
-			results_open_questions = self.results_open_questions
+			results_open_questions = self.results_open_questions,
 		)
 
 	def print_question_and_answer_labels(self):
 		"""
 		Pretty-print the question codes and labels, and for each question - its answer codes and labels.
 		"""
-		for question_code,question_label in self.map_question_code_to_label.items():
-			print(f"\n{question_code}: {question_label}")
+		lines = []   # printed at once, which is much faster than a print per line
+		for question_code,question_label in self.question_codes_and_labels:
+			lines.append(f"\n{question_code}: {question_label}")
 			if question_code in self.map_question_code_to_map_answer_code_to_label:
 				for answer_code,answer_label in self.map_question_code_to_map_answer_code_to_label[question_code].items():
-					print(f"\t{answer_code}: {answer_label}")
+					lines.append(f"\t{answer_code}: {answer_label}")
+		print("\n".join(lines))
 
 	def voter_id(self, voter_index:int=0, voter_id:int=None):
 		"""
@@ -95,14 +187,58 @@ class PollResults:
 		If both are given, voter_id takes precedence.
 		"""
 		if voter_id is None:
-			voter_id = self.voter_ids[voter_index]
+			voter_id = int(self.voter_ids[voter_index])
 		return voter_id
 
+	def row_index(self, voter_id:int)->int:
+		"""
+		:return the row of the given voter in results_closed_questions.
+		"""
+		return self.results_closed_questions.index.get_loc(voter_id)
+
+	def closed_answer(self, row_index:int, question_code:str):
+		"""
+		:return the answer in the given row (see row_index) to the given closed question.
+		"""
+		answer = self.map_column_to_answers[question_code][row_index]
+		return answer.item() if isinstance(answer, np.generic) else answer   # a plain python number, as in map_voter_id_to_closed_answers
+
+	@functools.cached_property
+	def map_voter_id_to_closed_answers(self)->dict:
+		"""
+		A map from each voter id to a map from each closed-question code to the voter's answer code.
+		Built on first access only, since the methods of this class do not need it.
+		"""
+		return self.results_closed_questions.to_dict(orient="index")
+
+	@functools.cached_property
+	def map_voter_id_to_open_answers(self)->dict:
+		"""
+		A map from each voter id to a map from each open-question code to the voter's answer (None if there are no open questions).
+		Built on first access only, since the methods of this class do not need it.
+		"""
+		if self.results_open_questions is None:
+			return None
+		return self.results_open_questions.to_dict(orient="index")
+
 	def subquestion_codes(self, question_code:str):
 		"""
 		returns the codes of all subquestions of a single multi-answer question.
+		A closed question without subquestions is treated as its own single subquestion.
 		"""
-		return [q for q in self.map_question_code_to_label if q.startswith(question_code)]
+		if question_code in self.map_question_code_to_subquestion_codes:
+			return self.map_question_code_to_subquestion_codes[question_code]
+		if question_code in self.map_column_to_index and question_code in self.map_question_code_to_label:
+			return [question_code]
+		return []
+
+	def subquestion_labels(self, question_code:str)->np.ndarray:
+		"""
+		returns the labels of all subquestions of a single multi-answer question, in the order of subquestion_codes.
+		"""
+		if question_code in self.map_question_code_to_subquestion_labels:
+			return self.map_question_code_to_subquestion_labels[question_code]
+		return np.array([self.map_question_code_to_label[code] for code in self.subquestion_codes(question_code)], dtype=object)
 
 	def get_voter_answer_single(self, question_code:str, voter_index:int=0, voter_id:int=None):
 		"""
@@ -114,9 +250,8 @@ class PollResults:
 		:return the answer label.
 		"""
 		voter_id = self.voter_id(voter_index, voter_id)
-		voter_closed_answers = self.map_voter_id_to_closed_answers[voter_id]
-		if question_code in voter_closed_answers:            # single-answer question
-			voter_answer = voter_closed_answers[question_code]
+		if question_code in self.map_column_to_index:            # single-answer question
+			voter_answer = self.closed_answer(self.row_index(voter_id), question_code)
 			return self.map_question_code_to_map_answer_code_to_label[question_code][voter_answer]
 		raise ValueError(f"Cannot find answer of voter {voter_id} to question {question_code}")	
 
@@ -130,10 +265,11 @@ class PollResults:
 		:return a map from the subquestion label to the answer code.
 		"""
 		voter_id = self.voter_id(voter_index, voter_id)
-		voter_closed_answers = self.map_voter_id_to_closed_answers[voter_id]
 		subquestion_codes = self.subquestion_codes(question_code)
 		if len(subquestion_codes)>0:
-			return {self.map_question_code_to_label[code]: voter_closed_answers[code] for code in subquestion_codes}
+			subquestion_labels = self.subquestion_labels(question_code)
+			row_index = self.row_index(voter_id)
+			return dict(zip(subquestion_labels, [self.closed_answer(row_index, code) for code in subquestion_codes]))
 		raise ValueError(f"Cannot find answer of voter {voter_id} to multi-answer question {question_code}")
 	
 	def get_voter_answer_rank(self, question_code:str, voter_index:int=0, voter_id:int=None):
@@ -166,25 +302,52 @@ class PollResults:
 		"""
 		:return all voters' answers to the given single-answer question.
 		"""
-		return [self.get_voter_answer_single(question_code, voter_id=id) for id in self.voter_ids]
+		if question_code not in self.columns:
+			raise ValueError(f"Cannot find answers to question {question_code}")
+		answers = self.results_closed_questions[question_code]
+		label_array = self.map_question_code_to_answer_label_array.get(question_code)
+		if label_array is not None and pandas.api.types.is_integer_dtype(answers) and answers.between(0, len(label_array)-1).all():
+			labels = label_array[answers.to_numpy()]
+			if not pandas.isnull(labels).any():
+				return labels.tolist()
+		map_answer_code_to_label = self.map_question_code_to_map_answer_code_to_label[question_code]
+		return [map_answer_code_to_label[answer] for answer in answers.tolist()]
+
+	def subquestion_labels_and_answers(self, question_code:str):
+		"""
+		get the answers of all voters to a multi-answer question, as a matrix.
+
+		:return a pair: a numpy array of the subquestion labels, and a numpy matrix with a row per voter and a column per subquestion.
+		"""
+		subquestion_codes = self.subquestion_codes(question_code)
+		if len(subquestion_codes)==0:
+			raise ValueError(f"Cannot find answers to multi-answer question {question_code}")
+		labels = self.subquestion_labels(question_code)
+		answers = self.results_closed_questions[subquestion_codes].to_numpy()
+		return (labels, answers)
 	
 	def get_voter_answers_multiple(self, question_code:str):
 		"""
 		:return all voters' answers to the given multi-answer question.
 		"""
-		return [self.get_voter_answer_multiple(question_code, voter_id=id) for id in self.voter_ids]
+		labels, answers = self.subquestion_labels_and_answers(question_code)
+		labels = labels.tolist()
+		return [dict(zip(labels, voter_answers)) for voter_answers in answers.tolist()]
 	
 	def get_voter_answers_rank(self, question_code:str):
 		"""
 		:return all voters' answers to the given "ranking" question.
 		"""
-		return [self.get_voter_answer_rank(question_code, voter_id=id) for id in self.voter_ids]
+		labels, answers = self.subquestion_labels_and_answers(question_code)
+		ranking = rank_matrix(answers)
+		return labels[ranking].tolist()
 	
 	def get_voter_answers_approval(self, question_code:str):
 		"""
 		:return all voters' answers to the given "approval" question.
 		"""
-		return [self.get_voter_answer_approval(question_code, voter_id=id) for id in self.voter_ids]
+		labels, answers = self.subquestion_labels_and_answers(question_code)
+		return [set(labels[approved]) for approved in answers>0]
 
 
 	def print_answers_of_one_voter(self, voter_index:int=0, voter_id:int=None):
@@ -195,28 +358,29 @@ class PollResults:
 		If both are given, voter_id takes precedence.
 		"""
 		voter_id = self.voter_id(voter_index, voter_id)
-		voter_closed_answers = self.map_voter_id_to_closed_answers[voter_id]
-		voter_open_answers = self.map_voter_id_to_open_answers[voter_id]
+		row_index = self.row_index(voter_id)
+		voter_open_answers = self.results_open_questions.loc[voter_id]
 		# print("voter_open_answers: ",voter_open_answers)
 
-		for question_code,question_label in self.map_question_code_to_label.items():
-			print(f"{question_code}: {question_label}")
-			if question_code in voter_open_answers:             # open (free-text) question
-				first_voter_answer = voter_open_answers[question_code]
-				print(f"\tTEXT: {first_voter_answer}")
-			elif f"{question_code}_1" in voter_open_answers:    # open (free-text) question
-				first_voter_answer = voter_open_answers[f"{question_code}_1"]
-				print(f"\tTEXT: {first_voter_answer}")
-			elif question_code in voter_closed_answers:         # closed questions:
-				if question_code in self.map_question_code_to_map_answer_code_to_label:   
-					voter_answer_code = int(voter_closed_answers[question_code])
+		lines = []
+		try:
+			for question_code,question_label in self.question_codes_and_labels:
+				lines.append(f"{question_code}: {question_label}")
+				if question_code not in self.map_question_code_to_kind_and_column:
+					raise ValueError(f"Cannot find question code {question_code}")
+				kind, column = self.map_question_code_to_kind_and_column[question_code]
+				if kind=="open":
+					first_voter_answer = voter_open_answers[column]
+					lines.append(f"\tTEXT: {first_voter_answer}")
+				elif kind=="coded":
+					voter_answer_code = int(self.closed_answer(row_index, column))
 					voter_answer_label = self.map_question_code_to_map_answer_code_to_label[question_code][voter_answer_code]
-					print(f"\t{voter_answer_code}: {voter_answer_label}")
-				else:                                                                     
-					first_voter_answer = voter_closed_answers[question_code]
-					print(f"\tDATA: {first_voter_answer}")
-			else:
-				raise ValueError(f"Cannot find question code {question_code}")
+					lines.append(f"\t{voter_answer_code}: {voter_answer_label}")
+				else:
+					first_voter_answer = self.closed_answer(row_index, column)
+					lines.append(f"\tDATA: {first_voter_answer}")
+		finally:   # print the answers found so far, even if some question is missing
+			print("\n".join(lines))
 
 	def partition_by_religion(self, religion_question_code:str="col_10"):
 		results_jews = self.filtered(f"{religion_question_code}==1")
@@ -227,15 +391,27 @@ class PollResults:
 		"""
 		Computes a table of the frequencies of answers to a single-answer question (in percents).
 		:param question_code: the question code.
-		:param query (optional): a query to filter the results before computation.
+		:param title (optional): the title of the table column.
 		:return a map from answer code to its frequency.
 		"""
+		key = ("all", question_code, title)
+		if key not in self.frequency_dicts_cache:
+			if question_code not in self.map_question_code_to_map_answer_code_to_label:   # e.g. "ext_id" or "start", which have no answer codes
+				raise KeyError(question_code)
+			answers = self.results_closed_questions[question_code]
+			answer_counts = answers.value_counts(sort=False).sort_index()
+			self.frequency_dicts_cache[key] = self._frequency_dict_from_counts(question_code, answer_counts, len(answers), answers.median(), title)
+		return dict(self.frequency_dicts_cache[key])
+
+	def _frequency_dict_from_counts(self, question_code:str, answer_counts:pandas.Series, num_of_voters:int, median_answer_code, title:str=None)->dict:
+		"""
+		Builds the table returned by frequency_dict, from the number of voters who gave each answer.
+		"""
 		map_answer_code_to_label = self.map_question_code_to_map_answer_code_to_label[question_code]
-		results = self.results_closed_questions
-		frequency_series = (results.groupby(question_code).count()["id"] / len(results) * 100).round(2)
+		frequency_series = (answer_counts / num_of_voters * 100).round(2)
 		the_dict = {"קוד": title}
 		the_dict.update(frequency_series.to_dict())
-		the_dict["חציון"] = map_answer_code_to_label[results.median(numeric_only=True)[question_code]]
+		the_dict["חציון"] = map_answer_code_to_label[median_answer_code]
 		return the_dict
 
 	def print_frequencies(self, question_code:str):
@@ -247,9 +423,33 @@ class PollResults:
 		frequency_dict = self.frequency_dict(question_code)
 		label = self.map_question_code_to_label[question_code]
 		map_answer_code_to_label = self.map_question_code_to_map_answer_code_to_label[question_code]
-		print(label,": ")
+		lines = [f"{label} : "]
 		for answer_code,frequency in frequency_dict.items():
-			print(f"{answer_code}\t{map_answer_code_to_label.get(answer_code,'')}\t{frequency}%")
+			lines.append(f"{answer_code}\t{map_answer_code_to_label.get(answer_code,'')}\t{frequency}%")
+		print("\n".join(lines))
+
+	def frequency_dicts_by_religion(self, question_code:str, religion_question_code:str="col_10")->tuple:
+		"""
+		Computes the tables of frequencies of answers to a single-answer question (in percents), 
+		for all voters, for Jews and for non-Jews.
+		:param question_code: the question code.
+		:param religion_question_code: the question code of the "religion" demographic question.
+		:return a triple of maps from answer code to its frequency, as in frequency_dict.
+		"""
+		key = ("religion", question_code, religion_question_code)
+		if key not in self.frequency_dicts_cache:
+			if question_code not in self.map_question_code_to_map_answer_code_to_label:
+				raise KeyError(question_code)
+			results = self.results_closed_questions
+			is_jew = (results[religion_question_code]==1).rename("is_jew")
+			answer_counts = results.groupby([is_jew, question_code]).size()    # a single pass computes the counts of both groups
+			group_sizes = is_jew.value_counts()
+			group_medians = results.groupby(is_jew)[question_code].median()
+			frequency_dict_all   = self._frequency_dict_from_counts(question_code, answer_counts.groupby(level=question_code).sum(), len(results), results[question_code].median(), title="כללי")
+			frequency_dict_jews  = self._frequency_dict_from_counts(question_code, answer_counts.xs(True, level="is_jew"), group_sizes[True], group_medians[True], title="יהודים")
+			frequency_dict_nonjews  = self._frequency_dict_from_counts(question_code, answer_counts.xs(False, level="is_jew"), group_sizes[False], group_medians[False], title="לא-יהודים")
+			self.frequency_dicts_cache[key] = (frequency_dict_all, frequency_dict_jews, frequency_dict_nonjews)
+		return tuple(dict(frequency_dict) for frequency_dict in self.frequency_dicts_cache[key])
 
 	def print_frequencies_by_religion(self, question_code:str, religion_question_code:str="col_10"):
 		"""
@@ -259,12 +459,11 @@ class PollResults:
 		:param query (optional): a query to filter the results before computation.
 		:param religion_question_code: the question code of the "religion" demographic question.
 		"""
-		frequency_dict_all   = self.frequency_dict(question_code, title="כללי")
-		frequency_dict_jews  = self.filtered(f"{religion_question_code}==1").frequency_dict(question_code, title="יהודים")
-		frequency_dict_nonjews  = self.filtered(f"{religion_question_code}!=1").frequency_dict(question_code, title="לא-יהודים")
+		frequency_dict_all, frequency_dict_jews, frequency_dict_nonjews = self.frequency_dicts_by_religion(question_code, religion_question_code)
 		label = self.map_question_code_to_label[question_code]
 		map_answer_code_to_label = self.map_question_code_to_map_answer_code_to_label[question_code]
-		print("\n",label,": ")
+		lines = [f"\n {label} : "]
 		for answer_code in frequency_dict_all.keys():
 			percentsign = "%" if isinstance(frequency_dict_all[answer_code], numbers.Number) else ""
-			print(f"{answer_code},{map_answer_code_to_label.get(answer_code,'')},{frequency_dict_all.get(answer_code,0)}{percentsign},{frequency_dict_jews.get(answer_code,0)}{percentsign},{frequency_dict_nonjews.get(answer_code,0)}{percentsign}")
+			lines.append(f"{answer_code},{map_answer_code_to_label.get(answer_code,'')},{frequency_dict_all.get(answer_code,0)}{percentsign},{frequency_dict_jews.get(answer_code,0)}{percentsign},{frequency_dict_nonjews.get(answer_code,0)}{percentsign}")
+		print("\n".join(lines))